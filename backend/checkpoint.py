@@ -0,0 +1,44 @@
+import os
+import pickle
+from typing import Optional
+
+# File header, bump the version whenever the payload layout changes
+CHECKPOINT_MAGIC = b"BBCK"
+CHECKPOINT_VERSION = 2
+# Fixed rather than HIGHEST_PROTOCOL so checkpoints load across Python upgrades
+PICKLE_PROTOCOL = 4
+
+
+def write_checkpoint(path: str, payload: dict):
+    """
+    Writes a checkpoint atomically (tmp file + rename), so a crash mid-write
+    never leaves a truncated file behind. Blocking, run it off the event loop.
+    The payload must only hold primitives (dict, list, tuple, str, int, float, None).
+    """
+    data = CHECKPOINT_MAGIC + bytes([CHECKPOINT_VERSION]) + pickle.dumps(payload, protocol=PICKLE_PROTOCOL)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str) -> Optional[dict]:
+    """Returns the checkpoint payload, or None if there is no usable checkpoint."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    header = CHECKPOINT_MAGIC + bytes([CHECKPOINT_VERSION])
+    if data[:len(header)] != header:
+        print(f"Ignoring checkpoint {path}: unknown format")
+        return None
+    try:
+        # Only our own primitives are in here, the file is written by write_checkpoint alone
+        return pickle.loads(data[len(header):])
+    except Exception as e:
+        print(f"Ignoring checkpoint {path}: {e!r}")
+        return None
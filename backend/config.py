@@ -1,4 +1,14 @@
 SHIP_HITBOX_RADIUS_UNITS = 10
 SHIP_TOTAL_HP = 100
 CANNONT_HIT_DMG = 10
-GAME_UPDATE_SECONDS = 10
\ No newline at end of file
+GAME_UPDATE_SECONDS = 10
+SCORE_DB_PATH = "scores.db"
+SCORE_FLUSH_SECONDS = 2
+ALL_TIME_LEADERBOARD_SIZE = 10
+DEAD_RECKONING_ERROR_UNITS = 5
+DEAD_RECKONING_HEARTBEAT_SECONDS = 30
+SIMULATION_WORKER_ENABLED = False
+SIMULATION_QUEUE_SIZE = 10000
+CHECKPOINT_PATH = "game_state.ckpt"
+CHECKPOINT_SECONDS = 5
+CHECKPOINT_RECONNECT_GRACE_SECONDS = 60
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 import uvicorn
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import json
 import asyncio
 from dataclasses import dataclass
@@ -9,7 +9,12 @@ from datetime import datetime
 import uuid
 from enum import Enum
 import math
+import time
+import signal
 from config import *
+from score_store import ScoreStore
+from simulation import SimulationWorker
+from checkpoint import read_checkpoint, write_checkpoint
 
 app = FastAPI()
 
@@ -27,15 +32,27 @@ class Player:
     position: Position  # Position enum indicating where they are in the ship
     relative_pos: dict  # {x: float, y: float} position relative to ship's center
 
+@dataclass(frozen=True)
+class ShipMotion:
+    position: dict  # {x: float, y: float}
+    velocity: dict  # {x: float, y: float}
+    last_update: float = 0 # timestamp
+    received_at: float = 0 # server monotonic time of the last location_update
+
 @dataclass
 class Ship:
     id: str
-    position: dict  # {x: float, y: float}
-    velocity: dict  # {x: float, y: float}
+    # Swapped as a whole on every location_update, so readers on the event loop
+    # never see a position from one update with the velocity or time of another
+    motion: ShipMotion
     players: Dict[str, Player]  # player_id -> Player
     health: int = SHIP_TOTAL_HP # Tmp initial health of player
     score: int = 0
-    last_update: float = 0 # timestamp
+    last_sent: Optional["SentShipState"] = None # what clients were last told about this ship
+
+    @property
+    def position(self) -> dict:
+        return self.motion.position
 
     def add_player(self, player_id: str, position: Position) -> bool:
         # If position is FREE, allow multiple players
@@ -99,6 +116,21 @@ class Ship:
         current_player.relative_pos = relative_positions[new_position]
         return True
 
+@dataclass
+class SentShipState:
+    motion: ShipMotion
+    sent_at: float
+    health: int
+    crew: tuple  # ((player_id, position), ...)
+
+    def predict_position(self, received_at: float) -> dict:
+        # Velocity is in units per second, extrapolated over server receive times
+        elapsed = received_at - self.motion.received_at
+        return {
+            "x": self.motion.position["x"] + self.motion.velocity["x"] * elapsed,
+            "y": self.motion.position["y"] + self.motion.velocity["y"] * elapsed
+        }
+
 @dataclass
 class Bullet:
     id: str
@@ -112,12 +144,12 @@ class GameState:
         self.ships: Dict[str, Ship] = {}
         # self.bullets: Dict[str, Bullet] = {}
         self.connections: Dict[str, WebSocket] = {}
+        self.removed_ship_ids: List[str] = []  # Ships removed since the last broadcast
         
     def add_ship(self, ship_id: str) -> Ship:
         ship = Ship(
             id=ship_id,
-            position={"x": 0, "y": 0},
-            velocity={"x": 0, "y": 0},
+            motion=ShipMotion(position={"x": 0, "y": 0}, velocity={"x": 0, "y": 0}),
             players={}
         )
         self.ships[ship_id] = ship
@@ -142,38 +174,196 @@ class GameState:
         ]
 
     def update_ship_location(self, ship_id: str, data: dict):
-        if ship_id in self.ships:
-            ship = self.ships[ship_id]
-            ship.position = data["position"]
-            ship.velocity = data["velocity"]
-            ship.last_update = data["timestamp"]
+        # .get() rather than a membership check, the ship can be removed concurrently by the I/O loop
+        ship = self.ships.get(ship_id)
+        if ship:
+            ship.motion = ShipMotion(
+                position=data["position"],
+                velocity=data["velocity"],
+                last_update=data["timestamp"],
+                received_at=time.monotonic()
+            )
+
+    def remove_ship(self, ship_id: str) -> Optional[Ship]:
+        ship = self.ships.pop(ship_id, None)
+        if ship:
+            self.removed_ship_ids.append(ship_id)
+        return ship
+
+    def to_checkpoint(self) -> dict:
+        """Flattens ships into primitives. Cheap, so it runs on the event loop; the write does not."""
+        return {
+            "ships": [
+                self._ship_checkpoint(ship)
+                for ship in list(self.ships.values())
+            ]
+        }
+
+    def _ship_checkpoint(self, ship: Ship) -> tuple:
+        motion = ship.motion
+        return (
+            ship.id,
+            motion.position["x"], motion.position["y"],
+            motion.velocity["x"], motion.velocity["y"],
+            ship.health, ship.score, motion.last_update,
+            [
+                (player.id, player.position.value, player.relative_pos["x"], player.relative_pos["y"])
+                for player in ship.players.values()
+            ]
+        )
+
+    def load_checkpoint(self, payload: dict):
+        for ship_id, x, y, vx, vy, health, score, last_update, players in payload["ships"]:
+            self.ships[ship_id] = Ship(
+                id=ship_id,
+                # Nobody is steering a restored ship until its owner reconnects, so it must
+                # not drift on clients; the saved velocity is dropped
+                motion=ShipMotion(
+                    position={"x": x, "y": y},
+                    velocity={"x": 0, "y": 0},
+                    last_update=last_update
+                ),
+                players={
+                    player_id: Player(
+                        id=player_id,
+                        position=Position(position),
+                        relative_pos={"x": rx, "y": ry}
+                    )
+                    for player_id, position, rx, ry in players
+                },
+                health=health,
+                score=score
+            )
+
+    def ships_to_broadcast(self, now: float) -> List[Ship]:
+        """
+        Dead reckoning: only return ships whose reported position strays from the
+        position extrapolated from what was last sent, whose health or crew changed,
+        or whose heartbeat is due. Marks returned ships as sent.
+        """
+        changed = []
+        for ship in self.ships.values():
+            # Read once, the simulation worker may swap in a newer one meanwhile
+            motion = ship.motion
+            crew = tuple((player.id, player.position.value) for player in ship.players.values())
+            sent = ship.last_sent
+            if sent is not None and sent.health == ship.health and sent.crew == crew \
+                    and now - sent.sent_at < DEAD_RECKONING_HEARTBEAT_SECONDS:
+                predicted = sent.predict_position(motion.received_at)
+                error = math.hypot(
+                    motion.position["x"] - predicted["x"],
+                    motion.position["y"] - predicted["y"]
+                )
+                if error <= DEAD_RECKONING_ERROR_UNITS:
+                    continue
+
+            ship.last_sent = SentShipState(
+                motion=motion,
+                sent_at=now,
+                health=ship.health,
+                crew=crew
+            )
+            changed.append(ship)
+        return changed
+
+class CrewRegistry:
+    """
+    Crew connections indexed both ways (ship -> crew, player -> ship),
+    so a ship disconnect can tear down its whole crew in one go.
+    """
+    def __init__(self):
+        self.ship_crews: Dict[str, Set[str]] = {}  # ship_id -> player_ids
+        self.player_ships: Dict[str, str] = {}  # player_id -> ship_id
+        self.connections: Dict[str, WebSocket] = {}  # player_id -> WebSocket
+
+    def add_player(self, ship_id: str, player_id: str, websocket: WebSocket):
+        self.ship_crews.setdefault(ship_id, set()).add(player_id)
+        self.player_ships[player_id] = ship_id
+        self.connections[player_id] = websocket
+
+    def remove_player(self, player_id: str):
+        # Safe to call twice, the ship teardown and the player's own handler both do
+        ship_id = self.player_ships.pop(player_id, None)
+        self.connections.pop(player_id, None)
+        crew = self.ship_crews.get(ship_id)
+        if crew is not None:
+            crew.discard(player_id)
+            if not crew:
+                del self.ship_crews[ship_id]
+
+    def remove_ship(self, ship_id: str) -> List[WebSocket]:
+        """Unregisters the ship's whole crew and returns their sockets for closing."""
+        sockets = []
+        for player_id in self.ship_crews.pop(ship_id, set()):
+            del self.player_ships[player_id]
+            sockets.append(self.connections.pop(player_id))
+        return sockets
+
+    def get_connection(self, ship_id: str, player_id: str) -> Optional[WebSocket]:
+        # Ships may only reach players of their own crew
+        if self.player_ships.get(player_id) != ship_id:
+            return None
+        return self.connections.get(player_id)
+
+    def get_crew_connections(self, ship_id: str) -> List[WebSocket]:
+        return [self.connections[player_id] for player_id in self.ship_crews.get(ship_id, ())]
 
 game_state = GameState()
+score_store = ScoreStore(SCORE_DB_PATH, SCORE_FLUSH_SECONDS, ALL_TIME_LEADERBOARD_SIZE)
+
+def serialize_ship(ship: Ship, now: float) -> dict:
+    """
+    Ships are serialized from the state dead reckoning last decided on, with its age
+    in seconds, so clients extrapolate position + velocity * (age + time since
+    receipt) from the same reference the server predicts from.
+    """
+    sent = ship.last_sent
+    # Joined after this round's ships_to_broadcast
+    motion = ship.motion if sent is None else sent.motion
+    return {
+        "id": ship.id,
+        "position": motion.position,
+        "velocity": motion.velocity,
+        "age": now - motion.received_at if motion.received_at else 0,
+        "health": ship.health,
+        "players": [
+            {
+                "id": player.id,
+                "position": player.position.value,
+                "relative_pos": player.relative_pos
+            }
+            for player in ship.players.values()
+        ],
+        "timestamp": motion.last_update
+    }
 
 async def broadcast_game_state():
+    # ship_id -> the socket that already holds a full snapshot and only needs deltas.
+    # Compared by identity, a ship reconnecting under the same id needs a new snapshot
+    synced_connections: Dict[str, WebSocket] = {}
+    last_leaderboard = None
     while True:
+        now = time.monotonic()
+        changed_ships = game_state.ships_to_broadcast(now)
+        removed_ship_ids = game_state.removed_ship_ids
+        game_state.removed_ship_ids = []
+        # Only resend the leaderboard when it changed, full snapshots always carry it
+        leaderboard = game_state.get_leaderboard()
+        leaderboard_changed = leaderboard != last_leaderboard
+        last_leaderboard = leaderboard
+        synced_connections = {
+            connection_id: connection
+            for connection_id, connection in synced_connections.items()
+            if game_state.connections.get(connection_id) is connection
+        }
+
         if game_state.connections:
-            # Prepare all game_state update message
+            # Prepare the game_state update message, only carrying ships clients can't predict
             message = {
                 "type": "state_update",
-                "ships": [
-                    {
-                        "id": ship.id,
-                        "position": ship.position,
-                        "velocity": ship.velocity,
-                        "health": ship.health,
-                        "players": [
-                            {
-                                "id": player.id,
-                                "position": player.position.value,
-                                "relative_pos": player.relative_pos
-                            }
-                            for player in ship.players.values()
-                        ],
-                        "timestamp": ship.last_update
-                    }
-                    for ship in game_state.ships.values()
-                ],
+                "full": False,
+                "ships": [serialize_ship(ship, now) for ship in changed_ships],
+                "removed_ships": removed_ship_ids,
                 # "bullets": [
                 #     {
                 #         "id": bullet.id,
@@ -183,26 +373,104 @@ async def broadcast_game_state():
                 #     }
                 #     for bullet in game_state.bullets.values()
                 # ],
-                "leaderboard": game_state.get_leaderboard()
             }
+            if leaderboard_changed:
+                message["leaderboard"] = leaderboard
+            delta_text = json.dumps(message)
+            full_text = None
             
-            # Broadcast to all connected clients
-            for connection in game_state.connections.values():
+            # Broadcast to all connected clients, new ones get every ship once
+            for connection_id, connection in list(game_state.connections.items()):
+                if synced_connections.get(connection_id) is connection:
+                    text = delta_text
+                else:
+                    if full_text is None:
+                        full_text = json.dumps({
+                            **message,
+                            "full": True,
+                            "ships": [serialize_ship(ship, now) for ship in game_state.ships.values()],
+                            "removed_ships": [],
+                            "leaderboard": leaderboard
+                        })
+                    text = full_text
                 try:
-                    await connection.send_text(json.dumps(message))
+                    await connection.send_text(text)
+                    synced_connections[connection_id] = connection
                 except:
                     pass
         await asyncio.sleep(GAME_UPDATE_SECONDS)
 
+async def checkpoint_game_state():
+    while True:
+        await asyncio.sleep(CHECKPOINT_SECONDS)
+        # Any failure only skips this round, checkpointing carries on
+        try:
+            payload = game_state.to_checkpoint()
+            await asyncio.to_thread(write_checkpoint, CHECKPOINT_PATH, payload)
+        except Exception as e:
+            print(f"Checkpoint failed: {e!r}")
+
+# uvicorn closes every socket with 1012 before the shutdown event runs, so that event
+# is too late to tell a server restart from a client that sent 1012 itself
+server_shutting_down = False
+
+def watch_server_shutdown():
+    """Chains onto the signal handlers uvicorn installed to flag a shutdown first."""
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            global server_shutting_down
+            server_shutting_down = True
+            previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # Not on the main thread (e.g. under a test client), nothing to chain onto
+            return
+
+async def expire_restored_ships(ship_ids: List[str]):
+    # Restored ships whose client never came back are dropped like a normal disconnect
+    await asyncio.sleep(CHECKPOINT_RECONNECT_GRACE_SECONDS)
+    for ship_id in ship_ids:
+        if ship_id not in game_state.connections:
+            ship = game_state.remove_ship(ship_id)
+            if ship:
+                score_store.record_match_result(ship.id, ship.score, ship.health)
+
 @app.on_event("startup")
 async def startup_event():
+    watch_server_shutdown()
+    payload = read_checkpoint(CHECKPOINT_PATH)
+    if payload:
+        game_state.load_checkpoint(payload)
+        print(f"Restored {len(game_state.ships)} ships from {CHECKPOINT_PATH}")
+        asyncio.create_task(expire_restored_ships(list(game_state.ships)))
+    score_store.start()
+    if SIMULATION_WORKER_ENABLED:
+        simulation_worker.start()
     asyncio.create_task(broadcast_game_state())
+    asyncio.create_task(checkpoint_game_state())
 
-# Player : Ship Mapping (To know which player moved)
-player_ship_mapping: Dict[str, str] = {}
+@app.on_event("shutdown")
+async def shutdown_event():
+    simulation_worker.stop()
+    # Final checkpoint so a clean restart loses nothing, without risking the score buffer
+    try:
+        write_checkpoint(CHECKPOINT_PATH, game_state.to_checkpoint())
+    except Exception as e:
+        print(f"Final checkpoint failed: {e!r}")
+    score_store.stop()
+
+@app.get("/leaderboard")
+async def all_time_leaderboard():
+    return JSONResponse(score_store.get_all_time_leaderboard())
 
-# Track WebSocket connections for both ships and players
-player_connections: Dict[str, WebSocket] = {}
+# Player : Ship mapping and player WebSocket connections
+crew_registry = CrewRegistry()
 
 
 def line_circle_intersection(line_start, line_dir, circle_center, radius):
@@ -288,6 +556,35 @@ def detect_closest_hit(bullet, ships, radius):
     
     return closest_ship
 
+def resolve_bullet(ship_id: str, bullet_data: dict):
+    ship = game_state.ships.get(ship_id)
+    if not ship:
+        return
+
+    bullet = game_state.add_bullet(bullet_data, ship_id)
+    radius = SHIP_HITBOX_RADIUS_UNITS
+    
+    # Check for collisions (simplified for now)
+    # Iterate over a copy, ships can join or leave while the simulation worker runs
+    closest_ship = detect_closest_hit(bullet, dict(game_state.ships), radius)
+
+    if closest_ship:
+        closest_ship.health -= CANNONT_HIT_DMG
+        ship.score += 1
+        score_store.record_score(ship.id, ship.score, ship.health)
+        score_store.record_score(closest_ship.id, closest_ship.score, closest_ship.health)
+        # del game_state.bullets[bullet.id]
+
+def apply_simulation_message(ship_id: str, message: dict):
+    if message["type"] == "location_update":
+        game_state.update_ship_location(ship_id, message["data"])
+    elif message["type"] == "bullet_update":
+        resolve_bullet(ship_id, message["data"])
+
+# Only used when SIMULATION_WORKER_ENABLED, otherwise simulation runs inline on the event loop.
+# Keeps handlers from waiting on collision work, but shares the GIL, see SimulationWorker
+simulation_worker = SimulationWorker(apply_simulation_message, SIMULATION_QUEUE_SIZE)
+
 @app.websocket("/joinship")
 async def join_ship_websocket(websocket: WebSocket, ship_id: str):
     """
@@ -300,12 +597,17 @@ async def join_ship_websocket(websocket: WebSocket, ship_id: str):
         return
         
     await websocket.accept()
+
+    # The ship may have been torn down while accept() was awaited
+    if ship_id not in game_state.ships:
+        await websocket.close(code=4000, reason="Ship not found")
+        return
     
     # Generate player_id for identification
     player_id = str(uuid.uuid4())
 
     # Store player connection
-    player_connections[player_id] = websocket
+    crew_registry.add_player(ship_id, player_id, websocket)
     
     try:
         # Send initial player_id created back to the player
@@ -329,68 +631,85 @@ async def join_ship_websocket(websocket: WebSocket, ship_id: str):
                 
     except WebSocketDisconnect:
         pass
+    finally:
+        crew_registry.remove_player(player_id)
 
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, ship_id: Optional[str] = None):
     """
     WebSocket endpoint for ship-server communication.
     Handles location updates, bullet updates, and player communication forwarding.
+    Passing the ship_id of a ship restored from a checkpoint reconnects into it.
     """
     await websocket.accept()
     
-    # Generate ship_id for our initial connection
-    ship_id = str(uuid.uuid4())
-    
-    # Init ship in game state
-    game_state.add_ship(ship_id)
+    restored = ship_id in game_state.ships and ship_id not in game_state.connections
+    if not restored:
+        # Generate ship_id for our initial connection
+        ship_id = str(uuid.uuid4())
+        
+        # Init ship in game state
+        game_state.add_ship(ship_id)
     
     # Store connection
     game_state.connections[ship_id] = websocket
+    close_code = None
     
     try:
         # Send ship_id to the client
         await websocket.send_text(json.dumps({
             "type": "init",
-            "ship_id": ship_id
+            "ship_id": ship_id,
+            "restored": restored
         }))
         
         while True:
             data = await websocket.receive_text()
             message = json.loads(data)
             
-            if message["type"] == "location_update":
-                game_state.update_ship_location(ship_id, message["data"])
-                
-            elif message["type"] == "bullet_update":
-                bullet = game_state.add_bullet(message["data"], ship_id)
-                radius = SHIP_HITBOX_RADIUS_UNITS
-                
-                # Check for collisions (simplified for now)
-                closest_ship = detect_closest_hit(bullet, game_state.ships, radius)
-
-                if closest_ship:
-                    closest_ship.health -= CANNONT_HIT_DMG
-                    game_state.ships[ship_id].score += 1
-                    # del game_state.bullets[bullet.id]
-
+            if message["type"] in ("location_update", "bullet_update"):
+                if SIMULATION_WORKER_ENABLED:
+                    simulation_worker.submit(ship_id, message)
+                else:
+                    apply_simulation_message(ship_id, message)
 
             elif message["type"] == "player_communication":
                 print(message)
                 # Forward message to specific player
                 if "player_id" in message:
-                    player_id = message["player_id"]
-                    if player_id in player_connections:
-                        player_socket = player_connections[player_id]
+                    player_socket = crew_registry.get_connection(ship_id, message["player_id"])
+                    if player_socket:
                         # Forward the entire message to the player
                         await player_socket.send_text(json.dumps(message))
+
+            elif message["type"] == "crew_communication":
+                # Forward one message to the whole crew, serialized once
+                text = json.dumps(message)
+                for player_socket in crew_registry.get_crew_connections(ship_id):
+                    try:
+                        await player_socket.send_text(text)
+                    except:
+                        pass
                     
-    except WebSocketDisconnect:
-        # Cleanup on disconnect
-        del game_state.connections[ship_id]
-        if ship_id in game_state.ships:
-            del game_state.ships[ship_id]
+    except WebSocketDisconnect as e:
+        close_code = e.code
+    finally:
+        # Cleanup on disconnect, or on any error that ends the handler.
+        # Unregister everything before the first await so no player can join a dying ship
+        game_state.connections.pop(ship_id, None)
+        # Keep the ship for the final checkpoint only when this server is restarting,
+        # a 1012 sent by the client is an ordinary disconnect
+        if not (close_code == 1012 and server_shutting_down):
+            ship = game_state.remove_ship(ship_id)
+            if ship:
+                score_store.record_match_result(ship.id, ship.score, ship.health)
+        for player_socket in crew_registry.remove_ship(ship_id):
+            try:
+                await player_socket.close(code=4002, reason="Ship disconnected")
+            except:
+                pass
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,13 +1,15 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 import uvicorn
-from typing import Dict
+from typing import Dict, List, Optional
 import json
 import asyncio
 from enum import Enum
 import uuid
 
 GAME_UPDATE_SECONDS = 2
+BOMB_BATCH_TICK_SECONDS = 0.05
+BOMB_BATCH_FLUSH_THRESHOLD: Optional[int] = 16  # Flush early once this many bombs are queued, None to only flush per tick
 
 app = FastAPI()
 
@@ -19,8 +21,44 @@ class Team(Enum):
     def get_opposite_team(cls, team):
         return cls.TEAM_B if team == cls.TEAM_A else cls.TEAM_A
 
+class TeamOutbox:
+    """
+    Collects bomb events for one team connection and sends them as a single
+    bomb_batch frame per tick instead of one frame per bomb.
+    """
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.pending: List[list] = []  # [x, y] per bomb
+
+    async def add_bomb(self, message: dict) -> bool:
+        """Queues a bomb_update, returns False and drops it if it has no numeric x/y."""
+        x, y = message.get("x"), message.get("y")
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (x, y)):
+            return False
+
+        self.pending.append([x, y])
+        if BOMB_BATCH_FLUSH_THRESHOLD is not None and len(self.pending) >= BOMB_BATCH_FLUSH_THRESHOLD:
+            # Runs in the sending team's handler, a dead receiver must not take it down
+            try:
+                await self.flush()
+            except:
+                pass
+        return True
+
+    async def flush(self):
+        if not self.pending:
+            return
+        # Swap before awaiting so bombs queued during the send go into the next batch
+        bombs = self.pending
+        self.pending = []
+        await self.websocket.send_text(json.dumps({
+            "type": "bomb_batch",
+            "bombs": bombs
+        }))
+
 # Track WebSocket connections
 team_connections: Dict[Team, WebSocket] = {}  # Team websocket connections
+team_outboxes: Dict[Team, TeamOutbox] = {}  # Batched outbound bomb events per team
 player_connections: Dict[str, WebSocket] = {}  # Player websocket connections
 
 @app.websocket("/joingame")
@@ -90,6 +128,7 @@ async def websocket_endpoint(websocket: WebSocket, team: str):
         
     # Store team connection
     team_connections[selected_team] = websocket
+    team_outboxes[selected_team] = TeamOutbox(websocket)
     
     try:
         # Send initial confirmation
@@ -103,10 +142,11 @@ async def websocket_endpoint(websocket: WebSocket, team: str):
             message = json.loads(data)
             
             if message["type"] == "bomb_update":
-                # Forward bomb update to opposite team
+                # Queue bomb update for the opposite team's next batch
                 opposite_team = Team.get_opposite_team(selected_team)
-                if opposite_team in team_connections:
-                    await team_connections[opposite_team].send_text(json.dumps(message))
+                if opposite_team in team_outboxes:
+                    if not await team_outboxes[opposite_team].add_bomb(message):
+                        print(f"Dropping malformed bomb_update from {selected_team.value}: {message}")
             
             elif message["type"] == "player_communication":
                 if "player_id" in message and message["player_id"] in player_connections:
@@ -114,7 +154,11 @@ async def websocket_endpoint(websocket: WebSocket, team: str):
                     await player_socket.send_text(json.dumps(message))
                     
     except WebSocketDisconnect:
-        del team_connections[selected_team]
+        pass
+    finally:
+        # Always free the team slot, otherwise the team can never reconnect
+        team_connections.pop(selected_team, None)
+        team_outboxes.pop(selected_team, None)
 
 async def websocket_keepalive():
     while True:
@@ -138,9 +182,20 @@ async def websocket_keepalive():
 
         await asyncio.sleep(GAME_UPDATE_SECONDS)
 
+async def flush_team_outboxes():
+    while True:
+        for outbox in list(team_outboxes.values()):
+            try:
+                await outbox.flush()
+            except:
+                pass
+
+        await asyncio.sleep(BOMB_BATCH_TICK_SECONDS)
+
 @app.on_event("startup")
 async def startup_event():
     asyncio.create_task(websocket_keepalive())
+    asyncio.create_task(flush_team_outboxes())
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
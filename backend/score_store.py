@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class ScoreStore:
+    """
+    Write-behind persistence of ship scores and match results.
+    The event loop only touches in-memory buffers; a background thread
+    flushes them to SQLite in one transaction per interval.
+    """
+
+    def __init__(self, db_path: str, flush_seconds: float, leaderboard_size: int):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self.leaderboard_size = leaderboard_size
+
+        self._lock = threading.Lock()
+        self._pending_scores: Dict[str, Tuple[int, int, float]] = {}  # ship_id -> (score, health, updated_at)
+        self._pending_results: List[Tuple[str, int, int, float]] = []  # (ship_id, score, health, ended_at)
+        self._leaderboard: List[dict] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="score-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def record_score(self, ship_id: str, score: int, health: int):
+        # Later changes to the same ship overwrite earlier ones, so a volley only costs one row
+        with self._lock:
+            self._pending_scores[ship_id] = (score, health, time.time())
+
+    def record_match_result(self, ship_id: str, score: int, health: int):
+        with self._lock:
+            self._pending_results.append((ship_id, score, health, time.time()))
+
+    def get_all_time_leaderboard(self) -> List[dict]:
+        # Served from the cache refreshed by the writer thread, never hits the database
+        return self._leaderboard
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stop.wait(self.flush_seconds):
+                # Keep retrying the setup, buffers are kept until the database is usable
+                conn = conn or self._connect()
+                if conn:
+                    self._flush(conn)
+            # Final flush so nothing buffered is lost on shutdown
+            if conn:
+                self._flush(conn)
+        finally:
+            if conn:
+                conn.close()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            self._create_tables(conn)
+            self._refresh_leaderboard(conn)
+            return conn
+        except sqlite3.Error as e:
+            print(f"Score store setup failed: {e!r}")
+            if conn:
+                conn.close()
+            return None
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ship_scores ("
+                "ship_id TEXT PRIMARY KEY, score INTEGER NOT NULL, "
+                "health INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS match_results ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, ship_id TEXT NOT NULL, "
+                "score INTEGER NOT NULL, health INTEGER NOT NULL, ended_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ship_scores_score ON ship_scores (score DESC)")
+
+    def _flush(self, conn: sqlite3.Connection):
+        with self._lock:
+            scores = self._pending_scores
+            results = self._pending_results
+            self._pending_scores = {}
+            self._pending_results = []
+
+        if not scores and not results:
+            return
+
+        try:
+            self._write(conn, scores, results)
+        except sqlite3.Error as e:
+            print(f"Score store flush failed, retrying next interval: {e!r}")
+            self._requeue(scores, results)
+            return
+
+        try:
+            self._refresh_leaderboard(conn)
+        except sqlite3.Error as e:
+            print(f"Score store leaderboard refresh failed: {e!r}")
+
+    def _requeue(self, scores: Dict[str, Tuple[int, int, float]], results: List[Tuple[str, int, int, float]]):
+        with self._lock:
+            # Scores recorded since the failed batch was taken are newer, keep those
+            for ship_id, values in scores.items():
+                self._pending_scores.setdefault(ship_id, values)
+            self._pending_results = results + self._pending_results
+
+    def _write(self, conn: sqlite3.Connection, scores: Dict[str, Tuple[int, int, float]],
+               results: List[Tuple[str, int, int, float]]):
+        with conn:
+            conn.executemany(
+                "INSERT INTO ship_scores (ship_id, score, health, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(ship_id) DO UPDATE SET score = excluded.score, "
+                "health = excluded.health, updated_at = excluded.updated_at",
+                [(ship_id, *values) for ship_id, values in scores.items()]
+            )
+            conn.executemany(
+                "INSERT INTO match_results (ship_id, score, health, ended_at) VALUES (?, ?, ?, ?)",
+                results
+            )
+
+    def _refresh_leaderboard(self, conn: sqlite3.Connection):
+        rows = conn.execute(
+            "SELECT ship_id, score FROM ship_scores ORDER BY score DESC LIMIT ?",
+            (self.leaderboard_size,)
+        ).fetchall()
+        # Swap the whole list so readers on the event loop never see a partial update
+        self._leaderboard = [{"ship_id": ship_id, "score": score} for ship_id, score in rows]
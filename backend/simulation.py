@@ -0,0 +1,59 @@
+import queue
+import threading
+from typing import Callable
+
+
+class SimulationWorker:
+    """
+    Runs simulation messages (location and bullet updates) on a dedicated thread,
+    in arrival order. The websocket handlers only enqueue, so they never wait for
+    collision work to finish before reading the next frame.
+
+    This decouples ordering and handler latency, not CPU: the thread shares the
+    GIL with the event loop, so heavy collision work still competes with socket
+    handling. The queue is bounded; when it is full, messages are dropped rather
+    than letting a volley flood grow memory without limit.
+    """
+
+    def __init__(self, handler: Callable[[str, dict], None], max_queue_size: int):
+        self.handler = handler  # handler(ship_id, message), only ever called from the worker thread
+        self.dropped = 0
+        self._inbox = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        # Sentinel, everything queued before it is still processed
+        self._inbox.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, ship_id: str, message: dict) -> bool:
+        """Queues a message without blocking, returns False if it was dropped because the queue is full."""
+        try:
+            self._inbox.put_nowait((ship_id, message))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                print(f"Simulation queue full, {self.dropped} messages dropped so far")
+            return False
+
+    def _run(self):
+        while True:
+            item = self._inbox.get()
+            if item is None:
+                return
+            ship_id, message = item
+            try:
+                self.handler(ship_id, message)
+            except Exception as e:
+                # A bad message must not kill the simulation for everyone
+                print(f"Simulation error for ship {ship_id}: {e!r}")
@@ -9,6 +9,10 @@ from datetime import datetime
 import uuid
 from enum import Enum
 import math
+from checkpoint import read_checkpoint, write_checkpoint
+
+CHECKPOINT_PATH = "tmp_game_state.ckpt"
+CHECKPOINT_SECONDS = 5
 
 app = FastAPI()
 
@@ -111,6 +115,44 @@ class GameState:
             ship.velocity = data["velocity"]
             ship.last_update = data["timestamp"]
 
+    def to_checkpoint(self) -> dict:
+        # Controllers are not saved, players rejoin through /joingame after a restart
+        return {
+            "ships": [
+                (
+                    ship.id, ship.team.value,
+                    ship.position["x"], ship.position["y"],
+                    ship.velocity["x"], ship.velocity["y"],
+                    ship.health, ship.score, ship.last_update
+                )
+                for ship in list(self.ships.values())
+            ],
+            "bombs": [
+                (bomb.id, bomb.ship_id, bomb.team.value, bomb.position["x"], bomb.position["y"], bomb.timestamp)
+                for bomb in list(self.bombs.values())
+            ]
+        }
+
+    def load_checkpoint(self, payload: dict):
+        for ship_id, team, x, y, vx, vy, health, score, last_update in payload["ships"]:
+            self.ships[ship_id] = Ship(
+                id=ship_id,
+                position={"x": x, "y": y},
+                velocity={"x": vx, "y": vy},
+                team=Team(team),
+                health=health,
+                score=score,
+                last_update=last_update
+            )
+        for bomb_id, ship_id, team, x, y, timestamp in payload["bombs"]:
+            self.bombs[bomb_id] = Bomb(
+                id=bomb_id,
+                position={"x": x, "y": y},
+                ship_id=ship_id,
+                team=Team(team),
+                timestamp=timestamp
+            )
+
 game_state = GameState()
 
 async def broadcast_game_state():
@@ -150,10 +192,32 @@ async def broadcast_game_state():
                     pass
         await asyncio.sleep(10)
 
+async def checkpoint_game_state():
+    while True:
+        await asyncio.sleep(CHECKPOINT_SECONDS)
+        # Any failure only skips this round, checkpointing carries on
+        try:
+            payload = game_state.to_checkpoint()
+            await asyncio.to_thread(write_checkpoint, CHECKPOINT_PATH, payload)
+        except Exception as e:
+            print(f"Checkpoint failed: {e!r}")
+
 @app.on_event("startup")
 async def startup_event():
-    game_state.initialize_ships()
+    payload = read_checkpoint(CHECKPOINT_PATH)
+    if payload:
+        game_state.load_checkpoint(payload)
+    else:
+        game_state.initialize_ships()
     asyncio.create_task(broadcast_game_state())
+    asyncio.create_task(checkpoint_game_state())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    try:
+        write_checkpoint(CHECKPOINT_PATH, game_state.to_checkpoint())
+    except Exception as e:
+        print(f"Final checkpoint failed: {e!r}")
 
 @app.websocket("/joingame")
 async def join_game_websocket(websocket: WebSocket, team: str):
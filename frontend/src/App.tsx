@@ -109,6 +109,10 @@ function App() {
       } else if (message.type == "bomb_update") {
         const position = new Vec2D(message.x, message.y);
         bombQRef.current.push(position);
+      } else if (message.type == "bomb_batch") {
+        for (const [x, y] of message.bombs) {
+          bombQRef.current.push(new Vec2D(x, y));
+        }
       } else {
         console.log("Unknown message type", message);
       }